@@ -7,18 +7,22 @@ This script analyzes PDF bank statements to:
 2. Extract business name and address
 3. The net change in account balance according to the transactions and whether or not this reconciles with the balances present on the document
 """
+from concurrent.futures import ThreadPoolExecutor
 from pydantic import BaseModel
+import argparse
+import logging
 import os
+import threading
 from src.main.models.business_info import BusinessInfo
 from src.main.integrity import check_document_integrity
-from src.main.business_info import check_business_info
+from src.main.business_info import validate_business_info
+from src.main.first_page_analysis import analyze_first_page
 from src.main.is_bank_statement import check_is_business_bank_statement
-from src.main.utils import get_pdf_metadata, get_first_page_as_markdown
-from src.main.llms import get_openai_client
+from src.main.utils import file_sha256, get_pdf_metadata, get_first_page_as_markdown
+from src.main.cache import DiskCache
 from src.main.balance_reconciliation import reconcile_balances
 from src.main.transaction_extraction import extract_transactions
 from dotenv import load_dotenv
-from src.main.prompts.balance_analysis import BALANCE_ANALYSIS_PROMPT
 from src.main.models.balance_analysis import BalanceAnalysis, Transaction
 from typing import Dict, Any, List, Optional
 from pathlib import Path
@@ -50,9 +54,13 @@ class AnalysisResult(BaseModel):
 
 # Constants
 MAX_FILE_SIZE_MB = 50  # Maximum PDF file size in MB
+RESULT_CACHE_DIR = ".result_cache"
 # Maximum number of transactions (2000/month * 12 months * 10 years)
 MAX_TRANSACTIONS = 24000
 
+# Analysis results keyed by the SHA-256 of the PDF contents
+_RESULT_CACHE = DiskCache(RESULT_CACHE_DIR)
+
 
 def _validate_pdf_file(pdf_path: str) -> bool:
     """
@@ -66,8 +74,10 @@ def _validate_pdf_file(pdf_path: str) -> bool:
     """
     path = Path(pdf_path)
 
-    # Check if file exists
-    if not path.exists():
+    # Check if file exists, getting its size with the same call
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
         print(f"Error: File '{path}' does not exist")
         return False
 
@@ -77,7 +87,7 @@ def _validate_pdf_file(pdf_path: str) -> bool:
         return False
 
     # Check file size
-    file_size_mb = path.stat().st_size / (1024 * 1024)
+    file_size_mb = stat.st_size / (1024 * 1024)
     if file_size_mb > MAX_FILE_SIZE_MB:
         print(
             f"Error: File size ({file_size_mb:.2f} MB) exceeds maximum allowed size ({MAX_FILE_SIZE_MB} MB)")
@@ -86,12 +96,14 @@ def _validate_pdf_file(pdf_path: str) -> bool:
     return True
 
 
-def analyze_bank_statement(pdf_path: str) -> AnalysisResult:
+def analyze_bank_statement(pdf_path: str, batch_mode: bool = False) -> AnalysisResult:
     """
     Analyze a PDF to determine if it's a bank statement and extract key information.
 
     Args:
         pdf_path: Path to the PDF file
+        batch_mode: Whether to extract the transactions of long statements
+            through the cheaper but slower Batch API
 
     Returns:
         dict: Analysis results
@@ -109,33 +121,44 @@ def analyze_bank_statement(pdf_path: str) -> AnalysisResult:
             reason=statement_check.reason
         )
 
-    # Step 2: Extract and validate business name and address
-    business_info = check_business_info(first_page_md)
-
-    if not business_info.is_valid:
-        return AnalysisResult(
-            is_valid_business_info=False,
-            reason=f"Invalid business information: {business_info.name_validation_message or business_info.address_validation_message}"
-        )
-
-    # Step 3: Extract starting and ending balances
-    balance_info_response = get_openai_client().beta.chat.completions.parse(
-        model="gpt-4o-2024-08-06",
-        messages=[
-            {"role": "user", "content": str(
-                BALANCE_ANALYSIS_PROMPT.invoke({"text": first_page_md}))},
-        ],
-        response_format=BalanceAnalysis,
-    ).choices[0].message.parsed
-
-    # Step 4: Extract transactions page by page
+    # Steps 2 and 3 are extracted from the first page with a single request,
+    # which is independent of step 4, so run them concurrently: extract
+    # business name and address together with the starting and ending
+    # balances, and extract transactions page by page
+    executor = ThreadPoolExecutor(max_workers=2)
+    # Stops the transaction extraction when the analysis ends early
+    cancel_extraction = threading.Event()
     try:
-        all_transactions = extract_transactions(pdf_path)
-    except ValueError as e:
-        return AnalysisResult(
-            is_bank_statement=False,
-            reason=str(e)
-        )
+        first_page_future = executor.submit(analyze_first_page, first_page_md)
+        transactions_future = executor.submit(
+            extract_transactions, pdf_path, batch_mode=batch_mode,
+            cancel=cancel_extraction)
+
+        first_page_analysis = first_page_future.result()
+        business_info = validate_business_info(first_page_analysis.business)
+
+        if not business_info.is_valid():
+            return AnalysisResult(
+                is_valid_business_info=False,
+                reason=f"Invalid business information: {business_info.name_validation_message or business_info.address_validation_message}"
+            )
+
+        balance_info_response = first_page_analysis.balances
+
+        try:
+            all_transactions = transactions_future.result()
+        except ValueError as e:
+            return AnalysisResult(
+                is_bank_statement=False,
+                reason=str(e)
+            )
+    finally:
+        # A running extraction can't be cancelled through its future, so
+        # tell it to stop sending requests; the requests already in flight
+        # still finish before the process exits
+        cancel_extraction.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
     # Use the balance reconciliation module to calculate totals and check if
     # balances reconcile
     balance_analysis = reconcile_balances(
@@ -202,6 +225,8 @@ def main():
     Main function to parse arguments and run the analysis.
     """
     load_dotenv()
+    logging.basicConfig(
+        level=logging.DEBUG if os.getenv("BSA_DEBUG") else logging.WARNING)
 
     # Verify OpenAI API key is set
     if not os.getenv("OPENAI_API_KEY"):
@@ -209,12 +234,20 @@ def main():
         sys.exit(1)
 
     # Check command line arguments
-    if len(sys.argv) != 2:
-        print("Usage: python mvp.py <pdf_file_path>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(
+        description="Analyze a PDF bank statement.")
+    parser.add_argument("pdf_file_path", help="Path to the PDF file")
+    parser.add_argument(
+        "--no-cache", action="store_true",
+        help="Analyze the document even if a cached result exists")
+    parser.add_argument(
+        "--batch", action="store_true",
+        help="Extract the transactions of long statements through the "
+             "OpenAI Batch API, which is cheaper but may take hours")
+    args = parser.parse_args()
 
     # Get PDF file path and validate it
-    pdf_path = sys.argv[1]
+    pdf_path = args.pdf_file_path
     if not _validate_pdf_file(pdf_path):
         sys.exit(1)
 
@@ -224,6 +257,15 @@ def main():
     for key, value in metadata.items():
         print(f"{key}: {value}")
 
+    # Reuse the result of a previous analysis of the exact same file
+    pdf_hash = file_sha256(pdf_path)
+    if not args.no_cache:
+        cached = _RESULT_CACHE.get(pdf_hash)
+        if cached is not None:
+            print("\nUsing cached analysis results")
+            display_results(AnalysisResult.model_validate_json(cached))
+            return
+
     print("Checking document integrity...")
     is_valid, integrity_message = check_document_integrity(pdf_path)
     if not is_valid:
@@ -232,7 +274,8 @@ def main():
 
     # Analyze the bank statement
     print("\nAnalyzing document...")
-    results = analyze_bank_statement(pdf_path)
+    results = analyze_bank_statement(pdf_path, batch_mode=args.batch)
+    _RESULT_CACHE.set(pdf_hash, results.model_dump_json())
 
     # Display results
     display_results(results)
@@ -5,14 +5,22 @@ This module contains functions to calculate totals from transactions and
 verify if the calculated balance matches the reported closing balance.
 """
 
-from typing import List, Optional
-from pydantic import BaseModel
-from src.main.utils import sum_moneys
+import logging
+from typing import List, Optional, Tuple
+from pydantic import BaseModel, ConfigDict
+from src.main.utils import from_minor_units, normalize_currency, to_minor_units
 from src.main.models.balance_analysis import BalanceAnalysis, Money, Transaction
 
+logger = logging.getLogger(__name__)
+
+# Number of transaction amounts logged when the balances don't reconcile
+DEBUG_LOGGED_TRANSACTIONS = 50
+
 
 class TransactionTotals(BaseModel):
     """Pydantic model for transaction totals."""
+    model_config = ConfigDict(frozen=True)
+
     total_deposits: Money
     total_withdrawals: Money
     net_change: Money
@@ -20,6 +28,8 @@ class TransactionTotals(BaseModel):
 
 class ReconciliationResult(BaseModel):
     """Pydantic model for reconciliation results."""
+    model_config = ConfigDict(frozen=True)
+
     opening_balance: Money
     closing_balance: Money
     total_deposits: Money
@@ -34,6 +44,55 @@ class ReconciliationResult(BaseModel):
         return self.reconciles
 
 
+def _scan_transactions(
+        transactions: List[Transaction],
+        opening_cents: int) -> Tuple[int, int, int, str]:
+    """
+    Compute all transaction aggregates in a single pass, in exact integer cents.
+
+    Args:
+        transactions: List of transaction objects
+        opening_cents: Opening balance in cents
+
+    Returns:
+        Tuple of (deposits_cents, withdrawals_cents, expected_closing_cents, currency)
+    """
+    deposits_cents = 0
+    withdrawals_cents = 0
+    currency = None
+    for t in transactions:
+        tx_currency = normalize_currency(t.money.currency)
+        if currency is None:
+            currency = tx_currency
+        elif tx_currency != currency:
+            raise ValueError(
+                f"Multiple currencies found in transactions: {currency} and {tx_currency}")
+        cents = to_minor_units(t.money.amount)
+        if cents > 0:
+            deposits_cents += cents
+        else:
+            withdrawals_cents += cents
+
+    expected_closing_cents = opening_cents + deposits_cents + withdrawals_cents
+    return deposits_cents, withdrawals_cents, expected_closing_cents, currency or ""
+
+
+def _totals_from_cents(
+        deposits_cents: int,
+        withdrawals_cents: int,
+        currency: str) -> TransactionTotals:
+    # Built from already validated values, so validation is skipped
+    return TransactionTotals.model_construct(
+        total_deposits=Money(
+            amount=from_minor_units(deposits_cents), currency=currency),
+        total_withdrawals=Money(
+            amount=from_minor_units(withdrawals_cents), currency=currency),
+        net_change=Money(
+            amount=from_minor_units(deposits_cents + withdrawals_cents),
+            currency=currency)
+    )
+
+
 def calculate_transaction_totals(
         transactions: List[Transaction]) -> TransactionTotals:
     """
@@ -45,48 +104,13 @@ def calculate_transaction_totals(
     Returns:
         TransactionTotals: Pydantic model containing total deposits, withdrawals, and net change
     """
-    if len(transactions) == 0:
-        return TransactionTotals(
-            total_deposits=Money(amount=0, currency=""),
-            total_withdrawals=Money(amount=0, currency=""),
-            net_change=Money(amount=0, currency="")
-        )
-    deposits = [t for t in transactions if t.money.amount > 0]
-    withdrawals = [t for t in transactions if t.money.amount < 0]
-
-    deposits_sum = Money(amount=0, currency="")
-    withdrawals_sum = Money(amount=0, currency="")
-
-    all_deposits = sum_moneys([t.money for t in deposits])
-    if len(all_deposits) > 1:
-        raise ValueError("Multiple currencies found in deposits")
-    elif len(all_deposits) == 1:
-        deposits_sum = all_deposits[0]
-
-    all_withdrawals = sum_moneys([t.money for t in withdrawals])
-    if len(all_withdrawals) > 1:
-        raise ValueError("Multiple currencies found in withdrawals")
-    elif len(all_withdrawals) == 1:
-        withdrawals_sum = all_withdrawals[0]
-
-    if deposits_sum.currency != "" and withdrawals_sum.currency != "":
-        if deposits_sum.currency != withdrawals_sum.currency:
-            raise ValueError(
-                "Deposits and withdrawals have different currencies")
-
-    net_change = Money(
-        amount=deposits_sum.amount + withdrawals_sum.amount,
-        currency=deposits_sum.currency
-    )
-    print(f"Total deposits: {deposits_sum}")
-    print(f"Total withdrawals: {withdrawals_sum}")
-    print(f"Net change: {net_change}")
-
-    return TransactionTotals(
-        total_deposits=deposits_sum,
-        total_withdrawals=withdrawals_sum,
-        net_change=net_change
-    )
+    deposits_cents, withdrawals_cents, _, currency = _scan_transactions(
+        transactions, 0)
+    totals = _totals_from_cents(deposits_cents, withdrawals_cents, currency)
+    logger.debug("Total deposits: %s", totals.total_deposits)
+    logger.debug("Total withdrawals: %s", totals.total_withdrawals)
+    logger.debug("Net change: %s", totals.net_change)
+    return totals
 
 
 def reconcile_balances(
@@ -103,16 +127,17 @@ def reconcile_balances(
     Returns:
         ReconciliationResult: Pydantic model with reconciliation results
     """
-    # Calculate totals
-    totals = calculate_transaction_totals(transactions)
+    # Calculate totals and the expected closing balance in one pass
+    deposits_cents, withdrawals_cents, expected_closing_cents, currency = _scan_transactions(
+        transactions, to_minor_units(balance_info.opening_balance.amount))
+    totals = _totals_from_cents(deposits_cents, withdrawals_cents, currency)
     net_change = totals.net_change
+    expected_closing = from_minor_units(expected_closing_cents)
 
-    # Calculate expected closing balance
-    expected_closing = balance_info.opening_balance.amount + net_change.amount
     # Check if balances reconcile
-    difference = round(abs(expected_closing -
-                           balance_info.closing_balance.amount), 3)
-    reconciles = difference < 0.01
+    closing_cents = to_minor_units(balance_info.closing_balance.amount)
+    reconciles = expected_closing_cents == closing_cents
+    difference = from_minor_units(abs(expected_closing_cents - closing_cents))
 
     if not reconciles:
         # Create a more detailed discrepancy reason
@@ -124,15 +149,17 @@ def reconcile_balances(
             f"Net change: {net_change}"
             f"Expected closing balance: {expected_closing}"
             f"Reported closing balance: {balance_info.closing_balance}"
-            f"Difference (should be less than 0.01): {difference}"
+            f"Difference: {difference}"
             f"This may be due to missing transactions, fees not captured in the transaction list, "
             f"or calculation errors."
         )
 
-        for tx in transactions:
-            print(tx.money.amount)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "First %d transaction amounts: %s", DEBUG_LOGGED_TRANSACTIONS,
+                [t.money.amount for t in transactions[:DEBUG_LOGGED_TRANSACTIONS]])
 
-        return ReconciliationResult(
+        return ReconciliationResult.model_construct(
             opening_balance=balance_info.opening_balance,
             closing_balance=balance_info.closing_balance,
             total_deposits=totals.total_deposits,
@@ -146,7 +173,7 @@ def reconcile_balances(
             transactions_count=len(transactions)
         )
 
-    return ReconciliationResult(
+    return ReconciliationResult.model_construct(
         opening_balance=balance_info.opening_balance,
         closing_balance=balance_info.closing_balance,
         total_deposits=totals.total_deposits,
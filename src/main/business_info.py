@@ -5,20 +5,84 @@ Business Information Extraction and Validation
 This module handles extracting and validating business information from bank statements.
 """
 
-from src.main.llms import get_openai_client
+from src.main.llm_cache import cached_parse, prompt_messages
 from src.main.models.business_info import Address, BusinessInfo
 from src.main.prompts.business_info import BUSINESS_INFO_PROMPT
 import sys
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Optional, Set, Tuple
 import re
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 
 # Add the src directory to the Python path
 src_path = str(Path(__file__).resolve().parent.parent)
 if src_path not in sys.path:
     sys.path.insert(0, src_path)
 
+_NONSENSE_NAME_RE = re.compile(r'^[\d\W_]+$')
+_DIGIT_RE = re.compile(r'\d')
+_ZIP_RE = re.compile(r'\b\d{5}(?:-\d{4})?\b')
+_WORD_RE = re.compile(r'[a-z]+')
+
+# Common bank names that might have been extracted instead of the business
+_COMMON_BANKS = frozenset({
+    "bank of america", "chase", "wells fargo", "citibank", "capital one",
+    "jpmorgan", "us bank", "pnc bank", "td bank", "bank", "credit union",
+    "first national", "regions bank", "suntrust", "bbt", "fifth third",
+    "citizens bank", "key bank", "huntington", "santander", "ally bank"
+})
+
+# Street type and unit terms found in addresses
+_ADDRESS_TERMS = frozenset({
+    'street', 'st', 'avenue', 'ave', 'road', 'rd', 'drive', 'dr',
+    'lane', 'ln', 'blvd', 'boulevard', 'way', 'court', 'ct', 'circle', 'cir',
+    'terrace', 'ter', 'place', 'pl', 'highway', 'hwy', 'parkway', 'pkwy',
+    'suite', 'ste', 'unit', 'apt', 'apartment', 'floor', 'fl'
+})
+
+# State abbreviations and names
+_STATES = frozenset(state.lower() for state in [
+    'AL', 'AK', 'AZ', 'AR', 'CA', 'CO', 'CT', 'DE', 'FL', 'GA',
+    'HI', 'ID', 'IL', 'IN', 'IA', 'KS', 'KY', 'LA', 'ME', 'MD',
+    'MA', 'MI', 'MN', 'MS', 'MO', 'MT', 'NE', 'NV', 'NH', 'NJ',
+    'NM', 'NY', 'NC', 'ND', 'OH', 'OK', 'OR', 'PA', 'RI', 'SC',
+    'SD', 'TN', 'TX', 'UT', 'VT', 'VA', 'WA', 'WV', 'WI', 'WY',
+    'Alabama', 'Alaska', 'Arizona', 'Arkansas', 'California', 'Colorado',
+    'Connecticut', 'Delaware', 'Florida', 'Georgia', 'Hawaii', 'Idaho',
+    'Illinois', 'Indiana', 'Iowa', 'Kansas', 'Kentucky', 'Louisiana',
+    'Maine', 'Maryland', 'Massachusetts', 'Michigan', 'Minnesota',
+    'Mississippi', 'Missouri', 'Montana', 'Nebraska', 'Nevada',
+    'New Hampshire', 'New Jersey', 'New Mexico', 'New York',
+    'North Carolina', 'North Dakota', 'Ohio', 'Oklahoma', 'Oregon',
+    'Pennsylvania', 'Rhode Island', 'South Carolina', 'South Dakota',
+    'Tennessee', 'Texas', 'Utah', 'Vermont', 'Virginia', 'Washington',
+    'West Virginia', 'Wisconsin', 'Wyoming'
+])
+
+# Phrases that indicate the bank's address was extracted
+_BANK_ADDRESS_INDICATORS = frozenset({
+    "branch location", "atm location", "bank address", "branch address",
+    "bank headquarters", "corporate headquarters", "main office"
+})
+
+_MAX_BANK_NAME_WORDS = max(len(bank.split()) for bank in _COMMON_BANKS)
+_MAX_ADDRESS_PHRASE_WORDS = max(
+    len(phrase.split())
+    for phrase in _ADDRESS_TERMS | _STATES | _BANK_ADDRESS_INDICATORS)
+
+
+def _phrases(text: str, max_words: int) -> Set[str]:
+    """
+    Split lowercased text into words and return every run of up to
+    max_words consecutive words, joined by single spaces.
+    """
+    words = _WORD_RE.findall(text)
+    return {
+        " ".join(words[i:i + n])
+        for n in range(1, max_words + 1)
+        for i in range(len(words) - n + 1)
+    }
+
 
 def validate_business_name(name: str) -> Tuple[bool, str]:
     """
@@ -30,32 +94,29 @@ def validate_business_name(name: str) -> Tuple[bool, str]:
     Returns:
         Tuple of (is_valid, reason_if_invalid)
     """
+    # Strip and lowercase the name once for all of the checks below
+    stripped_name = name.strip() if name else ""
+    lowered_name = stripped_name.lower()
+
     # Check if name is empty or just whitespace
-    if not name or name.strip() == "":
+    if stripped_name == "":
         return False, "Business name is empty"
 
     # Check if name is too short
-    if len(name.strip()) < 2:
+    if len(stripped_name) < 2:
         return False, "Business name is too short"
 
     # Check if name is too long (most business names aren't longer than 100
     # chars)
-    if len(name.strip()) > 100:
+    if len(stripped_name) > 100:
         return False, "Business name is unreasonably long"
 
     # Check for nonsensical patterns (like all numbers or special characters)
-    if re.match(r'^[\d\W_]+$', name.strip()):
+    if _NONSENSE_NAME_RE.match(stripped_name):
         return False, "Business name contains only numbers or special characters"
 
     # Check for common bank names that might have been extracted incorrectly
-    common_banks = [
-        "bank of america", "chase", "wells fargo", "citibank", "capital one",
-        "jpmorgan", "us bank", "pnc bank", "td bank", "bank", "credit union",
-        "first national", "regions bank", "suntrust", "bbt", "fifth third",
-        "citizens bank", "key bank", "huntington", "santander", "ally bank"
-    ]
-
-    if any(bank.lower() in name.lower() for bank in common_banks):
+    if _phrases(lowered_name, _MAX_BANK_NAME_WORDS) & _COMMON_BANKS:
         return False, "Extracted name appears to be a bank name, not a business name"
 
     return True, ""
@@ -85,54 +146,21 @@ def validate_address(address: Address) -> Tuple[bool, str]:
         return False, "Address is unreasonably long"
 
     # Check for some address-like patterns (numbers, street names, etc.)
-    has_number = bool(re.search(r'\d', address_str))
-
-    # More comprehensive list of address terms
-    address_terms = [
-        'street', 'st', 'avenue', 'ave', 'road', 'rd', 'drive', 'dr',
-        'lane', 'ln', 'blvd', 'boulevard', 'way', 'court', 'ct', 'circle', 'cir',
-        'terrace', 'ter', 'place', 'pl', 'highway', 'hwy', 'parkway', 'pkwy',
-        'suite', 'ste', 'unit', 'apt', 'apartment', 'floor', 'fl'
-    ]
-
-    has_common_terms = any(term in address_str.lower()
-                           for term in address_terms)
-
-    # Check for state abbreviations or names
-    states = [
-        'AL', 'AK', 'AZ', 'AR', 'CA', 'CO', 'CT', 'DE', 'FL', 'GA',
-        'HI', 'ID', 'IL', 'IN', 'IA', 'KS', 'KY', 'LA', 'ME', 'MD',
-        'MA', 'MI', 'MN', 'MS', 'MO', 'MT', 'NE', 'NV', 'NH', 'NJ',
-        'NM', 'NY', 'NC', 'ND', 'OH', 'OK', 'OR', 'PA', 'RI', 'SC',
-        'SD', 'TN', 'TX', 'UT', 'VT', 'VA', 'WA', 'WV', 'WI', 'WY',
-        'Alabama', 'Alaska', 'Arizona', 'Arkansas', 'California', 'Colorado',
-        'Connecticut', 'Delaware', 'Florida', 'Georgia', 'Hawaii', 'Idaho',
-        'Illinois', 'Indiana', 'Iowa', 'Kansas', 'Kentucky', 'Louisiana',
-        'Maine', 'Maryland', 'Massachusetts', 'Michigan', 'Minnesota',
-        'Mississippi', 'Missouri', 'Montana', 'Nebraska', 'Nevada',
-        'New Hampshire', 'New Jersey', 'New Mexico', 'New York',
-        'North Carolina', 'North Dakota', 'Ohio', 'Oklahoma', 'Oregon',
-        'Pennsylvania', 'Rhode Island', 'South Carolina', 'South Dakota',
-        'Tennessee', 'Texas', 'Utah', 'Vermont', 'Virginia', 'Washington',
-        'West Virginia', 'Wisconsin', 'Wyoming'
-    ]
-
-    has_state = any(
-        f" {state.lower()} " in f" {address_str.lower()} " for state in states)
+    has_number = bool(_DIGIT_RE.search(address_str))
 
-    # Check for ZIP code pattern
-    has_zip = bool(re.search(r'\b\d{5}(?:-\d{4})?\b', address_str))
+    # Lowercase and split the address into phrases once for all of the word
+    # list checks
+    phrases = _phrases(address_str.lower(), _MAX_ADDRESS_PHRASE_WORDS)
 
-    # Check for common bank address indicators
-    bank_address_indicators = [
-        "branch location", "atm location", "bank address", "branch address",
-        "bank headquarters", "corporate headquarters", "main office"
-    ]
+    # Check for address terms and state abbreviations or names
+    has_common_terms = bool(phrases & _ADDRESS_TERMS)
+    has_state = bool(phrases & _STATES)
 
-    is_bank_address = any(indicator.lower() in address_str.lower()
-                          for indicator in bank_address_indicators)
+    # Check for ZIP code pattern
+    has_zip = bool(_ZIP_RE.search(address_str))
 
-    if is_bank_address:
+    # Check for common bank address indicators
+    if phrases & _BANK_ADDRESS_INDICATORS:
         return False, "Address appears to be a bank address, not a business address"
 
     # Address should have a number and either common terms, state, or ZIP
@@ -174,7 +202,7 @@ def extract_zip_code(address: str) -> str:
         ZIP code if found, empty string otherwise
     """
     # Look for 5-digit ZIP code
-    zip_match = re.search(r'\b\d{5}(?:-\d{4})?\b', address)
+    zip_match = _ZIP_RE.search(address)
     if zip_match:
         return zip_match.group(0)
     return ""
@@ -184,6 +212,8 @@ class BusinessInfoResult(BaseModel):
     """
     Pydantic model to represent validated business information.
     """
+    model_config = ConfigDict(frozen=True)
+
     name: Optional[str] = None
     name_valid: Optional[bool] = None
     name_validation_message: Optional[str] = None
@@ -199,7 +229,7 @@ class BusinessInfoResult(BaseModel):
         return (
             f"BusinessInfoResult(name='{self.name}', name_valid={self.name_valid}, "
             f"address='{self.address}', address_valid={self.address_valid}, "
-            f"zip_code='{self.zip_code}', is_valid={self.is_valid})"
+            f"zip_code='{self.zip_code}', is_valid={self.is_valid()})"
         )
 
 
@@ -214,15 +244,25 @@ def check_business_info(text: str) -> BusinessInfoResult:
         BusinessInfoResult object with business information and validation results
     """
     # Extract business info using LLM
-    business_info_response: BusinessInfo = get_openai_client().beta.chat.completions.parse(
+    business_info_response: BusinessInfo = cached_parse(
         model="gpt-4o-2024-08-06",
-        messages=[
-            {"role": "user", "content": str(
-                BUSINESS_INFO_PROMPT.invoke({"text": text}))},
-        ],
+        messages=prompt_messages(BUSINESS_INFO_PROMPT, text=text),
         response_format=BusinessInfo,
-    ).choices[0].message.parsed
+    )
 
+    return validate_business_info(business_info_response)
+
+
+def validate_business_info(business_info_response: BusinessInfo) -> BusinessInfoResult:
+    """
+    Validate business information that has already been extracted.
+
+    Args:
+        business_info_response: The extracted business name and address
+
+    Returns:
+        BusinessInfoResult object with business information and validation results
+    """
     # Validate business name
     name_valid, name_reason = validate_business_name(
         business_info_response.name)
@@ -235,7 +275,8 @@ def check_business_info(text: str) -> BusinessInfoResult:
     formatted_address = format_address(
         business_info_response.address) if address_valid else business_info_response.address
 
-    return BusinessInfoResult(
+    # Built from already validated values, so validation is skipped
+    return BusinessInfoResult.model_construct(
         name=business_info_response.name.strip(),
         name_valid=name_valid,
         name_validation_message=name_reason if name_valid is False else None,
@@ -0,0 +1,37 @@
+"""
+Minimal file backed key/value cache.
+
+Every entry is stored in its own file inside the cache directory, so writers
+in different threads or processes never clobber each other.
+"""
+
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+
+class DiskCache:
+    """String cache persisted on disk, keyed by hex digests."""
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached value for key, or None if it is not cached."""
+        try:
+            return self._path(key).read_text(encoding="utf-8")
+        except FileNotFoundError:
+            return None
+
+    def set(self, key: str, value: str) -> None:
+        """Store value under key."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first so readers never see partial entries
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(value)
+        os.replace(tmp_path, self._path(key))
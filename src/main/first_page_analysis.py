@@ -0,0 +1,202 @@
+"""
+First page analysis module for bank statement analysis.
+
+This module extracts the business information and the balances from the
+first page of a bank statement. Well formatted statements are parsed with
+regular expressions; everything else is sent to the LLM in a single request.
+"""
+
+import logging
+import re
+import threading
+from typing import Optional
+
+from src.main.business_info import validate_address, validate_business_name
+from src.main.llm_cache import cached_parse, prompt_messages
+from src.main.prompts.first_page_analysis import FIRST_PAGE_ANALYSIS_PROMPT
+from src.main.models.balance_analysis import BalanceAnalysis, Money
+from src.main.models.business_info import Address, BusinessInfo
+from src.main.models.first_page_analysis import FirstPageAnalysis
+
+logger = logging.getLogger(__name__)
+
+_DATE = (
+    r"\d{1,2}/\d{1,2}/\d{2,4}"
+    r"|\d{4}-\d{2}-\d{2}"
+    r"|(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?\s+\d{1,2},?\s+\d{4}"
+)
+
+# "Opening balance on 01/01/2024: $1,234.56", "Ending Balance -$12.00 USD",
+# "Closing balance: $250.00 DR", ... A dash only separates the label from the
+# amount when followed by whitespace, otherwise it is the sign
+_BALANCE_RE = re.compile(
+    r"\b(?P<kind>opening|beginning|starting|closing|ending)\s+balance"
+    r"(?:\s+(?:on|as\s+of))?\s*(?P<date>" + _DATE + r")?\s*(?::|-(?=\s))?\s*"
+    r"(?<!\()(?P<sign>-)?(?P<symbol>[$€£])?\s*"
+    r"(?P<amount>-?\d{1,3}(?:,\d{3})*\.\d{2}|-?\d+\.\d{2})(?P<trailing_sign>-)?"
+    r"(?:\s*(?P<code>USD|EUR|GBP)\b)?(?:\s*\b(?P<marker>CR|DR)\b)?",
+    re.IGNORECASE)
+# "Statement period: 01/01/2024 - 01/31/2024", "March 1, 2024 through March 31, 2024"
+_PERIOD_RE = re.compile(
+    r"(?P<start>" + _DATE + r")\s*(?:-|–|to|through|thru)\s*(?P<end>" + _DATE + r")",
+    re.IGNORECASE)
+_HOLDER_RE = re.compile(
+    r"^[ \t]*(?:account\s+holder|account\s+name|business\s+name|customer(?:\s+name)?)"
+    r"[ \t]*[:\-][ \t]*(?P<name>\S[^\n]*?)[ \t]*$",
+    re.IGNORECASE | re.MULTILINE)
+_STREET_RE = re.compile(r"^[ \t]*(?P<street>\d+[^\n]*?)[ \t]*$", re.MULTILINE)
+_CITY_RE = re.compile(
+    r"^[ \t]*(?P<city>[A-Za-z][A-Za-z .'-]*?),[ \t]*(?P<state>[A-Z]{2})"
+    r"[ \t]+(?P<zip>\d{5}(?:-\d{4})?)[ \t]*$",
+    re.MULTILINE)
+
+_SYMBOL_CURRENCIES = {"$": "USD", "€": "EUR", "£": "GBP"}
+_OPENING_KINDS = frozenset({"opening", "beginning", "starting"})
+
+# Lines after the account holder name searched for the address
+_ADDRESS_LINES = 4
+
+# Documents analyzed by analyze_first_page, and how many needed the LLM
+_stats_lock = threading.Lock()
+_documents = 0
+_llm_fallbacks = 0
+
+
+def _signed_amount(match: re.Match, text: str) -> Optional[float]:
+    """
+    Amount of a balance match with its sign: a leading or trailing minus or
+    a DR marker make it negative, a CR marker keeps it positive.
+
+    Returns None when there is more than one sign marker, or another sign
+    right after the match, so the LLM reads the balance instead.
+    """
+    amount = match.group("amount")
+    marker = (match.group("marker") or "").upper()
+    signs = [match.group("sign"), amount.startswith("-") or None,
+             match.group("trailing_sign"), marker or None]
+    if sum(sign is not None for sign in signs) > 1:
+        return None
+    if text[match.end():match.end() + 1] in ("-", ")"):
+        return None
+    value = float(amount.lstrip("-").replace(",", ""))
+    if marker == "CR" or not any(signs):
+        return value
+    return -value
+
+
+def try_regex_extract_balances(first_page_md: str) -> Optional[BalanceAnalysis]:
+    """
+    Extract the opening and closing balances from a conventionally labeled
+    first page.
+
+    Returns None unless exactly one opening and one closing balance are
+    found, both with a currency and a date, either on the balance line or
+    from the statement period.
+    """
+    balances = {}
+    for match in _BALANCE_RE.finditer(first_page_md):
+        currency = match.group("code") or _SYMBOL_CURRENCIES.get(
+            match.group("symbol") or "")
+        if currency is None:
+            return None
+        amount = _signed_amount(match, first_page_md)
+        if amount is None:
+            return None
+        kind = "opening" if match.group("kind").lower() in _OPENING_KINDS else "closing"
+        balance = (
+            Money(amount=amount, currency=currency.upper()),
+            match.group("date"))
+        if balances.setdefault(kind, balance) != balance:
+            return None
+    if len(balances) != 2:
+        return None
+
+    (opening, opening_date), (closing, closing_date) = (
+        balances["opening"], balances["closing"])
+    if opening.currency != closing.currency:
+        return None
+    if opening_date is None or closing_date is None:
+        period = _PERIOD_RE.search(first_page_md)
+        if period is None:
+            return None
+        opening_date = opening_date or period.group("start")
+        closing_date = closing_date or period.group("end")
+
+    return BalanceAnalysis(
+        opening_balance=opening,
+        opening_date=opening_date,
+        closing_balance=closing,
+        closing_date=closing_date,
+    )
+
+
+def try_regex_extract_business_info(first_page_md: str) -> Optional[BusinessInfo]:
+    """
+    Extract the business name and US address that follow a labeled account
+    holder name, e.g. "Account Holder: Acme LLC" followed by the street line
+    and a "City, ST 12345" line.
+
+    Returns None unless the name and address are found and pass validation.
+    """
+    holder = _HOLDER_RE.search(first_page_md)
+    if holder is None:
+        return None
+    following = "\n".join(
+        first_page_md[holder.end():].lstrip("\n").split("\n")[:_ADDRESS_LINES])
+    street = _STREET_RE.search(following)
+    city = _CITY_RE.search(following, street.end()) if street else None
+    if city is None:
+        return None
+
+    business_info = BusinessInfo(
+        name=holder.group("name"),
+        address=Address(
+            street=street.group("street"),
+            city=city.group("city"),
+            state=city.group("state"),
+            zip=city.group("zip"),
+            country="US",
+        ),
+    )
+    if not validate_business_name(business_info.name)[0]:
+        return None
+    if not validate_address(business_info.address)[0]:
+        return None
+    return business_info
+
+
+def analyze_first_page(first_page_md: str) -> FirstPageAnalysis:
+    """
+    Extract the business information and the balances from the first page.
+
+    Args:
+        first_page_md: Markdown text of the first page
+
+    Returns:
+        FirstPageAnalysis: Business name and address, and opening and closing
+        balances with their dates
+    """
+    global _documents, _llm_fallbacks
+
+    business = try_regex_extract_business_info(first_page_md)
+    balances = try_regex_extract_balances(first_page_md)
+    with _stats_lock:
+        _documents += 1
+        if business is None or balances is None:
+            _llm_fallbacks += 1
+        documents, llm_fallbacks = _documents, _llm_fallbacks
+
+    if business is not None and balances is not None:
+        return FirstPageAnalysis(business=business, balances=balances)
+
+    logger.info(
+        "First page regex extraction incomplete (business info: %s, "
+        "balances: %s), using the LLM; fell back on %d of %d documents",
+        "found" if business is not None else "missing",
+        "found" if balances is not None else "missing",
+        llm_fallbacks, documents)
+    return cached_parse(
+        model="gpt-4o-2024-08-06",
+        messages=prompt_messages(FIRST_PAGE_ANALYSIS_PROMPT, text=first_page_md),
+        response_format=FirstPageAnalysis,
+    )
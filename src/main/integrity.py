@@ -1,10 +1,68 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import islice
 from typing import Tuple, List
+import hashlib
+import json
+import os
 import re
+import threading
 
 from openai import BaseModel
 from langchain_core.prompts import ChatPromptTemplate
-from main.utils import extract_pdf_pages
-from src.main.llms import get_openai_client
+from src.main.utils import extract_pdf_pages
+from src.main.cache import DiskCache
+from src.main.llm_cache import LLM_CACHE_DIR, cached_parse, prompt_messages
+
+# Maximum number of integrity requests sent to the LLM at the same time
+MAX_PARALLEL_PAGE_CHECKS = 8
+# Number of pages analysed together in a single integrity request
+PAGES_PER_INTEGRITY_REQUEST = 20
+# Maximum number of extracted batches waiting for the LLM
+MAX_PENDING_INTEGRITY_BATCHES = 2 * MAX_PARALLEL_PAGE_CHECKS
+# Length range (in characters) of pages eligible for the fast path
+FAST_PATH_MIN_LENGTH = 200
+FAST_PATH_MAX_LENGTH = 20000
+# Pages with fewer non-whitespace characters are suspiciously empty
+MIN_PAGE_CHARACTERS = 50  # Arbitrary threshold
+
+INTEGRITY_MODEL = "gpt-4o-2024-08-06"
+# Part of the verdict cache key; bump it whenever DOCUMENT_INTEGRITY_PROMPT or
+# DOCUMENT_INTEGRITY_BATCH_PROMPT changes so older verdicts are not reused
+INTEGRITY_PROMPT_VERSION = 1
+
+# Integrity verdicts keyed by normalized page content, so repeated boilerplate
+# pages (disclaimers, terms) are only analysed once regardless of page number
+_PAGE_VERDICT_CACHE = DiskCache(os.path.join(LLM_CACHE_DIR, "page_integrity"))
+
+# Delimited placeholders use negated character classes rather than lazy
+# quantifiers, so the scan stays linear and never backtracks; a single "}"
+# is allowed inside double curly braces, as the lazy pattern did. The leading
+# lookahead lets the engine skip every position that can't start any of the
+# alternatives with a single character class test.
+_PLACEHOLDER_RE = re.compile(
+    r"""
+    (?=[\[{<_XNTPI])
+    (?:
+      \[[^\]\n]*\]             # [Text in brackets]
+    | \{\{(?:[^}\n]|\}(?!\}))*\}\}  # {{Text in double curly braces}}
+    | <[^>\n]*>               # <Text in angle brackets>
+    | _{3,}                   # Underscores (3 or more)
+    | X{4,}                   # X's (4 or more)
+    | \bN/A\b                 # N/A
+    | \bTBD\b                 # TBD
+    | \bPLACEHOLDER\b         # PLACEHOLDER
+    | \bINSERT\ [^\n]*\ HERE\b  # INSERT ... HERE
+    )
+    """,
+    re.IGNORECASE | re.VERBOSE,
+)
+_NON_WHITESPACE_RE = re.compile(r'\S')
+_DATE_RE = re.compile(
+    r'\b\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}\b'        # 06/30/2021, 30.06.21
+    r'|\b\d{4}-\d{2}-\d{2}\b'                     # 2021-06-30
+    r'|\b(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.? \d{1,2}\b',
+    re.IGNORECASE)
+_AMOUNT_RE = re.compile(r'\d{1,3}(?:,\d{3})*\.\d{2}\b')
 
 
 class DocumentIntegrityResult(BaseModel):
@@ -14,39 +72,117 @@ class DocumentIntegrityResult(BaseModel):
     explanation: str
 
 
-def check_document_integrity(pdf_path: str) -> Tuple[bool, str]:
+class DocumentIntegrityBatch(BaseModel):
+    pages: List[DocumentIntegrityResult]
+
+
+def check_document_integrity(
+        pdf_path: str, strict: bool = False) -> Tuple[bool, str]:
     """
     Check the integrity of the document by verifying the number of pages and the
     presence of the first page, as well as running additional integrity checks.
 
+    The cheap local checks run inline while the pages are extracted. Pages
+    that pass them are grouped into batches of PAGES_PER_INTEGRITY_REQUEST,
+    each analysed by a single LLM request dispatched to a thread pool, so
+    extraction overlaps with the requests in flight. Extraction pauses while
+    MAX_PENDING_INTEGRITY_BATCHES batches are waiting and stops as soon as a
+    batch fails.
+
     Args:
         pdf_path: Path to the PDF file
+        strict: Analyze every page with the LLM, even regular looking ones
 
     Returns:
         Tuple of (is_valid, integrity_message)
     """
-    # Run detailed integrity checks on each page
-    i = 0
-    for page_content in extract_pdf_pages(pdf_path):
-        if i > 1000:
-            return False, "Document is too long"
-        is_valid, message = check_page_integrity(page_content, i)
-        if not is_valid:
-            return False, f"Page {i + 1} integrity issue: {message}"
-        i += 1
-    if i == 0:
-        return False, "Document is empty"
+    executor = ThreadPoolExecutor(max_workers=MAX_PARALLEL_PAGE_CHECKS)
+    # Limits the batches waiting for the LLM so extraction can't run far ahead
+    pending_batches = threading.BoundedSemaphore(MAX_PENDING_INTEGRITY_BATCHES)
+    # Set as soon as any batch fails, so extraction stops early
+    failed = threading.Event()
+    futures = {}
+
+    def on_batch_done(future):
+        pending_batches.release()
+        if (future.cancelled() or future.exception() is not None
+                or not all(is_valid for is_valid, _ in future.result())):
+            failed.set()
+
+    def submit_batch(batch):
+        pending_batches.acquire()
+        future = executor.submit(analyze_pages_with_langchain, batch)
+        futures[future] = batch
+        future.add_done_callback(on_batch_done)
+
+    try:
+        batch: List[Tuple[int, str]] = []
+        i = 0
+        for page_content in extract_pdf_pages(pdf_path):
+            if failed.is_set():
+                break
+            if i > 1000:
+                return False, "Document is too long"
+            is_valid, message = run_local_page_checks(page_content)
+            if not is_valid:
+                return False, f"Page {i + 1} integrity issue: {message}"
+            if strict or not looks_like_statement_page(page_content):
+                batch.append((i, page_content))
+                if len(batch) == PAGES_PER_INTEGRITY_REQUEST:
+                    submit_batch(batch)
+                    batch = []
+            i += 1
+        if i == 0:
+            return False, "Document is empty"
+        if batch and not failed.is_set():
+            submit_batch(batch)
+
+        for future in as_completed(futures):
+            for (page_number, _), (is_valid, message) in zip(
+                    futures[future], future.result()):
+                if not is_valid:
+                    return False, f"Page {page_number + 1} integrity issue: {message}"
+    finally:
+        # Don't wait for the remaining pages once the outcome is known
+        executor.shutdown(wait=False, cancel_futures=True)
     return True, "Document integrity check passed"
 
 
 def check_page_integrity(
-        page_content: str, page_number: int) -> Tuple[bool, str]:
+        page_content: str, page_number: int, strict: bool = False) -> Tuple[bool, str]:
     """
     Perform integrity checks on a single page.
 
     Args:
         page_content: Markdown text of the page
         page_number: Page number for reference
+        strict: Analyze the page with the LLM, even if it looks regular
+
+    Returns:
+        Tuple of (is_valid, integrity_message)
+    """
+    is_valid, message = run_local_page_checks(page_content)
+    if not is_valid:
+        return False, message
+
+    if not strict and looks_like_statement_page(page_content):
+        return True, "Page integrity check passed (fast path)"
+
+    # Use LangChain and OpenAI to analyze the page for integrity issues
+    ai_valid, ai_message = analyze_page_with_langchain(
+        page_content, page_number)
+    if not ai_valid:
+        return False, ai_message
+
+    return True, "Page integrity check passed"
+
+
+def run_local_page_checks(page_content: str) -> Tuple[bool, str]:
+    """
+    Run the cheap programmatic integrity checks on a single page.
+
+    Args:
+        page_content: Markdown text of the page
 
     Returns:
         Tuple of (is_valid, integrity_message)
@@ -59,42 +195,47 @@ def check_page_integrity(
     if is_suspiciously_empty(page_content):
         return False, "Page appears to be suspiciously empty"
 
-    # Check 3: Use LangChain and OpenAI to analyze the page for integrity
-    # issues
-    ai_valid, ai_message = analyze_page_with_langchain(
-        page_content, page_number)
-    if not ai_valid:
-        return False, ai_message
+    return True, "Local page checks passed"
 
-    return True, "Page integrity check passed"
+
+def looks_like_statement_page(text: str) -> bool:
+    """
+    Check if the page looks like a regular statement page: a normal amount of
+    text containing at least one date and one currency amount. Such pages
+    skip the LLM analysis unless strict checking is requested.
+    """
+    return (
+        FAST_PATH_MIN_LENGTH <= len(text) <= FAST_PATH_MAX_LENGTH
+        and _DATE_RE.search(text) is not None
+        and _AMOUNT_RE.search(text) is not None
+    )
 
 
 def contains_template_placeholders(text: str) -> bool:
     """Check if the text contains obvious template placeholders."""
-    placeholder_patterns = [
-        r'\[.*?\]',                      # [Text in brackets]
-        r'\{\{.*?\}\}',                  # {{Text in double curly braces}}
-        r'<.*?>',                        # <Text in angle brackets>
-        r'___+',                         # Underscores (3 or more)
-        r'XXXX+',                        # X's (4 or more)
-        r'\bN/A\b',                      # N/A
-        r'\bTBD\b',                      # TBD
-        r'\bPLACEHOLDER\b',              # PLACEHOLDER
-        r'\bINSERT .* HERE\b'            # INSERT ... HERE
-    ]
-
-    for pattern in placeholder_patterns:
-        if re.search(pattern, text, re.IGNORECASE):
-            return True
-
-    return False
+    return _PLACEHOLDER_RE.search(text) is not None
 
 
 def is_suspiciously_empty(text: str) -> bool:
     """Check if the page has suspiciously little content."""
-    # Remove whitespace and check content length
-    cleaned_text = re.sub(r'\s+', '', text)
-    return len(cleaned_text) < 50  # Arbitrary threshold
+    # Count non-whitespace characters, stopping as soon as there are enough.
+    # Avoids building a whitespace-free copy of the whole page.
+    non_whitespace = sum(1 for _ in islice(
+        _NON_WHITESPACE_RE.finditer(text), MIN_PAGE_CHARACTERS))
+    return non_whitespace < MIN_PAGE_CHARACTERS
+
+
+def page_fingerprint(text: str) -> str:
+    """Hash the page text with whitespace and letter case normalized."""
+    normalized = " ".join(text.split()).casefold()
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+def _verdict_key(page_content: str) -> str:
+    return hashlib.sha256(json.dumps(
+        {"m": INTEGRITY_MODEL, "v": INTEGRITY_PROMPT_VERSION,
+         "f": page_fingerprint(page_content)},
+        sort_keys=True).encode()).hexdigest()
 
 
 # Define the LangChain prompt template for document integrity analysis
@@ -127,6 +268,35 @@ Respond with a JSON object containing:
 )
 
 
+DOCUMENT_INTEGRITY_BATCH_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            """You are an expert in document forensics and integrity verification. Your task is to analyze several pages of a bank statement for signs of tampering, forgery, or other integrity issues.
+
+Analyze every page on its own. Look for:
+- Signs the text has been visibly modified or tampered with
+- Indications of hidden or overlaid text
+- Template placeholders or dummy data
+- Inconsistencies in formatting or data
+- Unusual patterns that suggest forgery
+
+Respond with a JSON object containing "pages": an array with exactly one entry per page, in the order the pages are given. Each entry contains:
+1. "is_valid": boolean (true if the page appears legitimate, false if issues detected)
+2. "confidence": number (0-100 indicating your confidence in the assessment)
+3. "issues_detected": array of strings (list of specific issues found, empty if none)
+4. "explanation": string (brief explanation of your determination)""",
+        ),
+        (
+            "user",
+            """Here are pages of a bank statement document, each starting with a "--- PAGE n ---" marker. Analyze each of them for integrity issues.
+
+{pages}""",
+        ),
+    ]
+)
+
+
 def analyze_page_with_langchain(
         page_content: str, page_number: int) -> Tuple[bool, str]:
     """
@@ -134,19 +304,79 @@ def analyze_page_with_langchain(
 
     Args:
         page_content: Markdown text of the page
-        page_number: Page number for reference
+        page_number: 0-based page number for reference
 
     Returns:
         Tuple of (is_valid, integrity_message)
     """
-    response = get_openai_client().beta.chat.completions.parse(
-        model="gpt-4o-2024-08-06",
-        messages=[
-            {"role": "user", "content": str(DOCUMENT_INTEGRITY_PROMPT.invoke(
-                {"text": page_content, "page_number": page_number}))},
-        ],
-        response_format=DocumentIntegrityResult,
-    ).choices[0].message.parsed
+    key = _verdict_key(page_content)
+    cached = _PAGE_VERDICT_CACHE.get(key)
+    if cached is not None:
+        response = DocumentIntegrityResult.model_validate_json(cached)
+    else:
+        response = cached_parse(
+            model=INTEGRITY_MODEL,
+            messages=prompt_messages(
+                DOCUMENT_INTEGRITY_PROMPT,
+                text=page_content, page_number=page_number + 1),
+            response_format=DocumentIntegrityResult,
+        )
+        _PAGE_VERDICT_CACHE.set(key, response.model_dump_json())
+    return _format_verdict(response)
+
+
+def analyze_pages_with_langchain(
+        pages: List[Tuple[int, str]]) -> List[Tuple[bool, str]]:
+    """
+    Use LangChain and OpenAI to analyze several pages for integrity issues
+    in a single request.
+
+    Args:
+        pages: List of (0-based page_number, page_content) tuples
+
+    Returns:
+        List of (is_valid, integrity_message) tuples, one per page
+    """
+    verdicts = {}
+    pending: List[Tuple[int, str]] = []
+    for page_number, page_content in pages:
+        cached = _PAGE_VERDICT_CACHE.get(_verdict_key(page_content))
+        if cached is not None:
+            verdicts[page_number] = _format_verdict(
+                DocumentIntegrityResult.model_validate_json(cached))
+        else:
+            pending.append((page_number, page_content))
+
+    if len(pending) == 1:
+        page_number, page_content = pending[0]
+        verdicts[page_number] = analyze_page_with_langchain(
+            page_content, page_number)
+    elif pending:
+        response = cached_parse(
+            model=INTEGRITY_MODEL,
+            messages=prompt_messages(
+                DOCUMENT_INTEGRITY_BATCH_PROMPT,
+                pages="\n\n".join(
+                    f"--- PAGE {page_number + 1} ---\n{page_content}"
+                    for page_number, page_content in pending)),
+            response_format=DocumentIntegrityBatch,
+        )
+        if len(response.pages) == len(pending):
+            for (page_number, page_content), result in zip(
+                    pending, response.pages):
+                _PAGE_VERDICT_CACHE.set(
+                    _verdict_key(page_content), result.model_dump_json())
+                verdicts[page_number] = _format_verdict(result)
+        else:
+            # The results can't be matched to the pages, analyze them one by one
+            for page_number, page_content in pending:
+                verdicts[page_number] = analyze_page_with_langchain(
+                    page_content, page_number)
+
+    return [verdicts[page_number] for page_number, _ in pages]
+
+
+def _format_verdict(response: DocumentIntegrityResult) -> Tuple[bool, str]:
     if not response.is_valid:
         return False, f"AI detected issues ({response.confidence}% confidence): {response.issues_detected}. {response.explanation}"
     return True, f"AI verification passed ({response.confidence}% confidence)"
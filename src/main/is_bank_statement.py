@@ -6,9 +6,9 @@ This script checks if this document has the potential to be a bank statement
 by validating essential components of a bank statement.
 """
 
-from src.main.llms import get_openai_client
+from concurrent.futures import ThreadPoolExecutor
+from src.main.llm_cache import cached_parse, prompt_messages
 from src.main.prompts.is_bank_statment import (
-    IS_PROMPT_STATEMENT_PROMPT,
     BANK_INFO_CHECK_PROMPT,
     STATEMENT_PERIOD_CHECK_PROMPT,
     CUSTOMER_INFO_CHECK_PROMPT
@@ -26,6 +26,12 @@ if src_path not in sys.path:
 
 # Import utility functions
 
+# Models used for each check. Whether the information is present at all is a
+# simple classification, which the smaller model handles well.
+BANK_INFO_CHECK_MODEL = "gpt-4o-mini"
+STATEMENT_PERIOD_CHECK_MODEL = "gpt-4o-mini"
+CUSTOMER_INFO_CHECK_MODEL = "gpt-4o-mini"
+
 
 def __check_bank_info(first_page_md: str) -> IsBankStatement:
     """
@@ -37,14 +43,11 @@ def __check_bank_info(first_page_md: str) -> IsBankStatement:
     Returns:
         Dict with results of bank info check
     """
-    return get_openai_client().beta.chat.completions.parse(
-        model="gpt-4o-2024-08-06",
-        messages=[
-            {"role": "user", "content": str(
-                BANK_INFO_CHECK_PROMPT.invoke({"text": first_page_md}))},
-        ],
+    return cached_parse(
+        model=BANK_INFO_CHECK_MODEL,
+        messages=prompt_messages(BANK_INFO_CHECK_PROMPT, text=first_page_md),
         response_format=IsBankStatement,
-    ).choices[0].message.parsed
+    )
 
 
 def __check_statement_period(first_page_md: str) -> IsBankStatement:
@@ -57,14 +60,11 @@ def __check_statement_period(first_page_md: str) -> IsBankStatement:
     Returns:
         Dict with results of statement period check
     """
-    return get_openai_client().beta.chat.completions.parse(
-        model="gpt-4o-2024-08-06",
-        messages=[
-            {"role": "user", "content": str(
-                STATEMENT_PERIOD_CHECK_PROMPT.invoke({"text": first_page_md}))},
-        ],
+    return cached_parse(
+        model=STATEMENT_PERIOD_CHECK_MODEL,
+        messages=prompt_messages(STATEMENT_PERIOD_CHECK_PROMPT, text=first_page_md),
         response_format=IsBankStatement,
-    ).choices[0].message.parsed
+    )
 
 
 def __check_customer_info(first_page_md: str) -> IsBankStatement:
@@ -77,14 +77,11 @@ def __check_customer_info(first_page_md: str) -> IsBankStatement:
     Returns:
         Dict with results of customer info check
     """
-    return get_openai_client().beta.chat.completions.parse(
-        model="gpt-4o-2024-08-06",
-        messages=[
-            {"role": "user", "content": str(
-                CUSTOMER_INFO_CHECK_PROMPT.invoke({"text": first_page_md}))},
-        ],
+    return cached_parse(
+        model=CUSTOMER_INFO_CHECK_MODEL,
+        messages=prompt_messages(CUSTOMER_INFO_CHECK_PROMPT, text=first_page_md),
         response_format=IsBankStatement,
-    ).choices[0].message.parsed
+    )
 
 
 def check_is_business_bank_statement(first_page_md: str) -> IsBankStatement:
@@ -97,37 +94,32 @@ def check_is_business_bank_statement(first_page_md: str) -> IsBankStatement:
     Returns:
         IsBankStatement: Result of bank statement validation
     """
-    # Check for essential components of a bank statement
-    bank_info = __check_bank_info(first_page_md)
-
-    if not bank_info.is_bank_statement:
-        return IsBankStatement(
-            is_bank_statement=False,
-            reason=f"No bank information found. {bank_info.reason}"
-        )
-
-    period_info = __check_statement_period(first_page_md)
-
-    if not period_info.is_bank_statement:
-        return IsBankStatement(
-            is_bank_statement=False,
-            reason=f"No statement period information found. {period_info.reason}"
-        )
-
-    customer_info = __check_customer_info(first_page_md)
-
-    if not customer_info.is_bank_statement:
-        return IsBankStatement(
-            is_bank_statement=False,
-            reason=f"No customer information found. {customer_info.reason}"
-        )
-
-    # If all essential components are present, make final determination
-    return get_openai_client().beta.chat.completions.parse(
-        model="gpt-4o-2024-08-06",
-        messages=[
-            {"role": "user", "content": str(
-                IS_PROMPT_STATEMENT_PROMPT.invoke({"text": first_page_md}))},
-        ],
-        response_format=IsBankStatement,
-    ).choices[0].message.parsed
+    # Check for essential components of a bank statement. The checks are
+    # independent, so they run concurrently and are inspected in priority
+    # order to report the same reason as checking them one by one.
+    checks = [
+        (__check_bank_info, "No bank information found."),
+        (__check_statement_period, "No statement period information found."),
+        (__check_customer_info, "No customer information found."),
+    ]
+    executor = ThreadPoolExecutor(max_workers=len(checks))
+    try:
+        futures = [(executor.submit(check, first_page_md), reason)
+                   for check, reason in checks]
+        for future, reason in futures:
+            result = future.result()
+            if not result.is_bank_statement:
+                return IsBankStatement(
+                    is_bank_statement=False,
+                    reason=f"{reason} {result.reason}"
+                )
+    finally:
+        # Don't wait for the remaining checks once one has failed
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    # All essential components are present, which is what a final
+    # determination would be based on anyway
+    return IsBankStatement(
+        is_bank_statement=True,
+        reason="Bank, statement period and customer information are all present."
+    )
@@ -0,0 +1,176 @@
+"""
+Exact-match cache for structured OpenAI completions.
+
+Responses are keyed by the model, the prompt messages and the response schema,
+so re-analysing the same text never hits the API twice. Recently used
+responses are also kept in memory, so repeated requests within a run don't
+read the disk either.
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Type, TypeVar
+
+from langchain_core.prompts import (
+    BasePromptTemplate,
+    ChatPromptTemplate,
+    HumanMessagePromptTemplate,
+)
+from pydantic import BaseModel
+
+from src.main.cache import DiskCache
+from src.main.llms import rate_limited_client
+
+LLM_CACHE_DIR = ".llm_cache"
+
+T = TypeVar("T", bound=BaseModel)
+
+# Number of responses also kept in memory, in front of the disk cache
+MEMORY_CACHE_SIZE = 1024
+
+_cache = DiskCache(LLM_CACHE_DIR)
+# Serialized responses by cache key, least recently used first. Responses are
+# kept serialized so callers can't modify each other's copies.
+_memory_cache: "OrderedDict[str, str]" = OrderedDict()
+_memory_cache_lock = threading.Lock()
+
+# OpenAI roles of langchain message types
+_ROLES = {"system": "system", "human": "user", "ai": "assistant"}
+
+# Compiled messages of each prompt template, by template identity. Prompts
+# are module level constants, so they live as long as this cache does.
+_COMPILED_PROMPTS: Dict[int, List[Tuple[str, str, List[str]]]] = {}
+_COMPILED_PROMPTS_LOCK = threading.Lock()
+
+
+def _compile_prompt(prompt: BasePromptTemplate) -> List[Tuple[str, str, List[str]]]:
+    """
+    Split a prompt template into (role, content, variables) messages.
+
+    Messages without variables, such as the system prompts, are formatted
+    here once and their content is final. The content of the other messages
+    is their f-string template, formatted with str.format on every call.
+    """
+    templates = prompt.messages if isinstance(
+        prompt, ChatPromptTemplate) else [HumanMessagePromptTemplate(prompt=prompt)]
+    compiled = []
+    for template in templates:
+        variables = list(template.input_variables)
+        # Formatting with placeholder values gives the message type, and the
+        # final content of messages without variables
+        message = template.format(**{variable: "" for variable in variables})
+        if variables:
+            if template.prompt.template_format != "f-string":
+                raise ValueError(
+                    f"Unsupported template format: {template.prompt.template_format}")
+            content = template.prompt.template
+        else:
+            content = message.content
+        compiled.append((_ROLES[message.type], content, variables))
+    return compiled
+
+
+def prompt_messages(prompt: BasePromptTemplate, **variables: str) -> List[Dict[str, str]]:
+    """
+    Format a prompt into OpenAI chat messages, keeping the system and user
+    messages of chat prompts separate so the static system prompt forms a
+    stable prefix that OpenAI can cache.
+
+    Args:
+        prompt: The prompt template to format
+        **variables: Values of the template variables
+
+    Returns:
+        List of messages with "role" and "content" keys
+    """
+    compiled = _COMPILED_PROMPTS.get(id(prompt))
+    if compiled is None:
+        with _COMPILED_PROMPTS_LOCK:
+            compiled = _COMPILED_PROMPTS.setdefault(
+                id(prompt), _compile_prompt(prompt))
+    return [
+        {"role": role,
+         "content": content.format(**variables) if names else content}
+        for role, content, names in compiled
+    ]
+
+
+def _cache_key(model: str, messages: List[Dict[str, str]],
+               response_format: Type[BaseModel]) -> str:
+    return hashlib.sha256(json.dumps(
+        {"m": model, "p": messages, "s": response_format.__name__},
+        sort_keys=True).encode()).hexdigest()
+
+
+def _memory_get(key: str) -> Optional[str]:
+    with _memory_cache_lock:
+        value = _memory_cache.get(key)
+        if value is not None:
+            _memory_cache.move_to_end(key)
+        return value
+
+
+def _memory_set(key: str, value: str) -> None:
+    with _memory_cache_lock:
+        _memory_cache[key] = value
+        _memory_cache.move_to_end(key)
+        if len(_memory_cache) > MEMORY_CACHE_SIZE:
+            _memory_cache.popitem(last=False)
+
+
+def get_cached_response(model: str, messages: List[Dict[str, str]],
+                        response_format: Type[T]) -> Optional[T]:
+    """
+    Return the cached response to a prompt, or None if it was never made.
+    """
+    key = _cache_key(model, messages, response_format)
+    cached = _memory_get(key)
+    if cached is None:
+        cached = _cache.get(key)
+        if cached is None:
+            return None
+        _memory_set(key, cached)
+    return response_format.model_validate_json(cached)
+
+
+def cache_response(model: str, messages: List[Dict[str, str]],
+                   response: BaseModel) -> None:
+    """
+    Store a response obtained outside of cached_parse, e.g. from a batch.
+    """
+    key = _cache_key(model, messages, type(response))
+    value = response.model_dump_json()
+    _memory_set(key, value)
+    _cache.set(key, value)
+
+
+def cached_parse(model: str, messages: List[Dict[str, str]],
+                 response_format: Type[T], nocache: bool = False) -> T:
+    """
+    Parse the response to a prompt into response_format, reusing the cached
+    response when the exact same request was made before.
+
+    Args:
+        model: Name of the OpenAI model
+        messages: Chat messages, e.g. from prompt_messages
+        response_format: Pydantic model the response is parsed into
+        nocache: Always make the request; the response is still cached
+
+    Returns:
+        Parsed response_format instance
+    """
+    if not nocache:
+        cached = get_cached_response(model, messages, response_format)
+        if cached is not None:
+            return cached
+
+    response = rate_limited_client.parse(
+        model=model,
+        messages=messages,
+        response_format=response_format,
+    ).choices[0].message.parsed
+    if response is not None:
+        cache_response(model, messages, response)
+    return response
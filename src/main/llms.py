@@ -1,5 +1,10 @@
+import functools
 import os
+import random
+import threading
+import time
 from dotenv import load_dotenv
+import httpx
 import openai
 
 
@@ -7,6 +12,133 @@ load_dotenv()
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
+# Account limits the shared client stays under
+MAX_REQUESTS_PER_MINUTE = 500
+MAX_TOKENS_PER_MINUTE = 200_000
+# Attempts per request before a transient error is raised to the caller
+MAX_ATTEMPTS = 5
+# Longest wait between two attempts, in seconds
+MAX_RETRY_WAIT = 60
+# Errors worth retrying: rate limits, timeouts, dropped connections and 5xx
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+# Connections kept open to the API; concurrent requests are multiplexed over
+# them with HTTP/2
+MAX_CONNECTIONS = 20
+# A stalled connection fails fast, while long multi-page responses still have
+# time to finish; timeouts are retried like other transient errors
+REQUEST_TIMEOUT = httpx.Timeout(180.0, connect=10.0)
+# Rough prompt size estimate used for the token bucket
+CHARS_PER_TOKEN = 4
+# Rough size of an image content part, e.g. a rendered page
+IMAGE_TOKENS = 1000
 
+
+def _estimate_tokens(content) -> int:
+    """Estimate the tokens of a message's text, or of its content parts."""
+    if isinstance(content, str):
+        return len(content) // CHARS_PER_TOKEN
+    return sum(
+        len(part.get("text", "")) // CHARS_PER_TOKEN
+        if part.get("type") == "text" else IMAGE_TOKENS
+        for part in content)
+
+
+@functools.lru_cache(maxsize=1)
 def get_openai_client():
-    return openai.Client()
+    # Shared so concurrent requests reuse one connection pool
+    return openai.Client(
+        # The SDK passes its own timeout with every request, so it is set
+        # here rather than on the HTTP client
+        timeout=REQUEST_TIMEOUT,
+        # RateLimitedClient.parse is the only retry layer, so retries go
+        # through the rate limits too
+        max_retries=0,
+        # Keeps the SDK's defaults, e.g. following redirects; httpx already
+        # negotiates gzip compressed responses
+        http_client=openai.DefaultHttpxClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS,
+                                max_keepalive_connections=MAX_CONNECTIONS),
+        ),
+    )
+
+
+class RateLimitedClient:
+    """
+    Structured completions throttled by request and token buckets.
+
+    Both buckets refill continuously at their per-minute limit divided by 60
+    each second, and a request waits until both can cover it. Rate limits,
+    timeouts, connection errors and server errors are retried with
+    exponential backoff and jitter.
+    """
+
+    def __init__(self,
+                 max_requests_per_minute: float = MAX_REQUESTS_PER_MINUTE,
+                 max_tokens_per_minute: float = MAX_TOKENS_PER_MINUTE,
+                 max_attempts: int = MAX_ATTEMPTS):
+        self.max_requests_per_minute = max_requests_per_minute
+        self.max_tokens_per_minute = max_tokens_per_minute
+        self.max_attempts = max_attempts
+        self._requests_available = float(max_requests_per_minute)
+        self._tokens_available = float(max_tokens_per_minute)
+        self._last_update = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._last_update
+        self._last_update = now
+        self._requests_available = min(
+            self.max_requests_per_minute,
+            self._requests_available + elapsed * self.max_requests_per_minute / 60)
+        self._tokens_available = min(
+            self.max_tokens_per_minute,
+            self._tokens_available + elapsed * self.max_tokens_per_minute / 60)
+
+    def _acquire(self, tokens: int) -> None:
+        # A request larger than the bucket would never fit, so let it through
+        # once the bucket is full
+        tokens = min(tokens, self.max_tokens_per_minute)
+        while True:
+            with self._lock:
+                self._refill()
+                if self._requests_available >= 1 and self._tokens_available >= tokens:
+                    self._requests_available -= 1
+                    self._tokens_available -= tokens
+                    return
+                wait = max(
+                    (1 - self._requests_available) * 60 / self.max_requests_per_minute,
+                    (tokens - self._tokens_available) * 60 / self.max_tokens_per_minute)
+            time.sleep(wait)
+
+    def parse(self, **kwargs):
+        """
+        Call beta.chat.completions.parse once the rate limits allow it.
+
+        Args:
+            **kwargs: Arguments passed on to beta.chat.completions.parse
+
+        Returns:
+            The parsed chat completion
+        """
+        tokens = sum(_estimate_tokens(message.get("content", ""))
+                     for message in kwargs.get("messages", []))
+
+        for attempt in range(self.max_attempts):
+            self._acquire(tokens)
+            try:
+                return get_openai_client().beta.chat.completions.parse(**kwargs)
+            except RETRYABLE_ERRORS:
+                if attempt == self.max_attempts - 1:
+                    raise
+                # Exponential backoff with full jitter
+                time.sleep(random.uniform(1, min(2 ** (attempt + 1), MAX_RETRY_WAIT)))
+
+
+# Shared by every call site so the limits apply to the whole process
+rate_limited_client = RateLimitedClient()
@@ -18,6 +18,10 @@ class PageTransactions(BaseModel):
     transactions: List[Transaction]
 
 
+class MultiPageTransactions(BaseModel):
+    pages: List[PageTransactions]
+
+
 class BalanceAnalysis(BaseModel):
     """Model for bank statement balance analysis"""
     opening_balance: Money = Field(description="Opening balance amount")
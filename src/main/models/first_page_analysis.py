@@ -0,0 +1,12 @@
+from pydantic import BaseModel, Field
+
+from src.main.models.balance_analysis import BalanceAnalysis
+from src.main.models.business_info import BusinessInfo
+
+
+class FirstPageAnalysis(BaseModel):
+    """Model for everything extracted from the first page in one request"""
+    business: BusinessInfo = Field(
+        description="Business name and address of the account holder")
+    balances: BalanceAnalysis = Field(
+        description="Opening and closing balances of the statement")
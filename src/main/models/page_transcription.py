@@ -0,0 +1,7 @@
+from pydantic import BaseModel, Field
+
+
+class PageTranscription(BaseModel):
+    """Model for the text read from an image of a page"""
+    text: str = Field(
+        description="Text of the page, in reading order, with one line per row")
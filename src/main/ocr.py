@@ -0,0 +1,68 @@
+"""
+OCR fallback for scanned bank statement pages.
+
+Pages without a text layer are rendered to an image and transcribed by a
+vision model, so the rest of the analysis can treat them like any other page.
+"""
+
+import base64
+import io
+
+from PIL import Image
+
+from src.main.llm_cache import cached_parse, prompt_messages
+from src.main.models.page_transcription import PageTranscription
+from src.main.prompts.page_transcription import PAGE_TRANSCRIPTION_PROMPT
+
+OCR_MODEL = "gpt-4o-mini"
+# Pages with less extracted text than this are treated as scanned
+OCR_MIN_CHARACTERS = 20
+# Render scale for scanned pages; 2 renders at 144 DPI
+OCR_RENDER_SCALE = 2
+# Images with more pixels than this are sent as JPEG instead of PNG
+MAX_PNG_PIXELS = 512 * 512
+JPEG_QUALITY = 85
+
+
+def encode_image(image: Image.Image) -> str:
+    """
+    Encode an image as a base64 data URL. Scanned pages are photographic, so
+    they are sent as JPEG, which is several times smaller than PNG. Small
+    images and images with transparency stay lossless PNG. The format is
+    chosen before encoding, so every image is encoded once.
+    """
+    buffer = io.BytesIO()
+    if (image.width * image.height > MAX_PNG_PIXELS
+            and image.mode not in ("RGBA", "LA", "P")):
+        image.convert("RGB").save(
+            buffer, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+        image_format = "jpeg"
+    else:
+        image.save(buffer, format="PNG")
+        image_format = "png"
+    return (f"data:image/{image_format};base64,"
+            f"{base64.b64encode(buffer.getvalue()).decode()}")
+
+
+def transcribe_page_image(image: Image.Image) -> str:
+    """
+    Transcribe the text of a rendered page with a vision model.
+
+    Args:
+        image: Image of the page
+
+    Returns:
+        Text of the page
+    """
+    messages = prompt_messages(PAGE_TRANSCRIPTION_PROMPT) + [{
+        "role": "user",
+        "content": [{
+            "type": "image_url",
+            "image_url": {"url": encode_image(image)},
+        }],
+    }]
+    return cached_parse(
+        model=OCR_MODEL,
+        messages=messages,
+        response_format=PageTranscription,
+    ).text
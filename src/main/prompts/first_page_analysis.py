@@ -0,0 +1,39 @@
+from langchain_core.prompts import ChatPromptTemplate
+
+FIRST_PAGE_ANALYSIS_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            """You are a financial document analyzer specialized in extracting information from bank statements.
+
+Your task is to extract both the business information and the balance information from the provided bank statement page.
+
+## Business information
+Extract the BUSINESS NAME and ADDRESS of the account holder.
+DO NOT extract the bank's name or the bank's address.
+
+The business name is the name of the company or individual that owns the account.
+It is typically found near the top of the statement, often labeled as "Account Holder", "Customer", "Business Name", or similar.
+
+The address is the mailing address of the business or individual account holder, not the bank's address.
+It is typically found near the business name.
+
+IMPORTANT:
+- Extract ONLY the business/account holder name, not the bank name
+- Extract ONLY the business/account holder address, not the bank address
+- If you cannot find a clear business name or address, return empty strings
+- Do not make up or guess information that is not clearly present
+
+## Balance information
+Extract:
+1. Opening balance - the starting balance for the statement period
+2. Opening date - the date of the opening balance
+3. Closing balance - the ending balance for the statement period
+4. Closing date - the date of the closing balance
+
+Return the information as a FirstPageAnalysis object, with the business information in "business" and the balance information in "balances".
+            """,
+        ),
+        ("human", "{text}"),
+    ]
+)
@@ -79,34 +79,6 @@ Respond with a JSON object containing:
     ]
 )
 
-IS_PROMPT_STATEMENT_PROMPT = ChatPromptTemplate.from_messages(
-    [
-        (
-            "system",
-            """You are an expert in analyzing financial documents. Your task is to determine if the provided document is a bank statement or not.
-
-Look for key indicators such as:
-- Account information
-- Transaction history
-- Beginning and ending balances
-- Bank name or logo
-- Statement period dates
-
-Your response should be clear and direct:
-1. Determine if this is a bank statement (yes or no)
-2. Provide a brief reason for your determination
-
-If it is NOT a bank statement, explain what type of document it appears to be instead.""",
-        ),
-        (
-            "user",
-            """Here is the text from a document. Determine if it is a bank statement or not, with a brief reason.
-
-{text}""",
-        ),
-    ]
-)
-
 BANK_IDENTIFICATION_PROMPT = ChatPromptTemplate.from_messages(
     [
         (
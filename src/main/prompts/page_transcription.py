@@ -0,0 +1,18 @@
+from langchain_core.prompts import ChatPromptTemplate
+
+PAGE_TRANSCRIPTION_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            """You are an expert at reading scanned financial documents. Your task is to transcribe the text of the provided image of a bank statement page.
+
+IMPORTANT:
+- Transcribe the text exactly as it appears, including all dates, descriptions, amounts and currency symbols
+- Keep the reading order, with each row of a table on its own line
+- Do not summarize, correct or add any information
+- If the page contains no text, return an empty string
+
+Return the text as a PageTranscription object.""",
+        ),
+    ]
+)
@@ -31,3 +31,35 @@ Return the transactions as a list of Transaction objects.
         ("human", "{text}"),
     ]
 )
+
+TRANSACTION_EXTRACTION_MULTI_PAGE_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            """You are a financial document analyzer specialized in extracting transaction data from bank statements.
+
+Your task is to extract all transactions from several bank statement pages. Each page starts with a "--- PAGE n ---" marker.
+
+For each transaction, extract:
+1. Date - in YYYY-MM-DD format
+2. ID - the transaction ID (if available)
+3. Description - the transaction description or payee
+4. Amount - the transaction amount as a decimal number
+5. Currency - the currency code (USD, EUR, etc.)
+6. Type - whether this is a "debit" (money leaving the account) or "credit" (money entering the account)
+
+IMPORTANT RULES FOR AMOUNT:
+- For debits (money leaving the account), use NEGATIVE numbers (e.g., -100.00)
+- For credits (money entering the account), use POSITIVE numbers (e.g., 100.00)
+- Do not include currency symbols in the amount field
+
+If the statement uses terms like:
+- "Withdrawal", "Payment", "Debit", "Charge" → These are debits (negative amounts)
+- "Deposit", "Credit", "Refund", "Interest" → These are credits (positive amounts)
+
+Return a MultiPageTransactions object whose "pages" array has exactly one entry per page, in the order the pages are given, each listing the transactions found on that page only.
+            """,
+        ),
+        ("human", "{pages}"),
+    ]
+)
@@ -4,50 +4,420 @@ Transaction extraction module for bank statement analysis.
 This module contains functions to extract transactions from bank statement pages.
 """
 
-from typing import List
-from src.main.utils import extract_pdf_pages
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import io
+import json
+import logging
+import re
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import openai
+# Private SDK helper, only used by _response_format_param
+from openai.lib._parsing import type_to_response_format_param
+from src.main.utils import extract_pdf_pages, get_pdf_page_count, normalize_currency
 from src.main.llms import get_openai_client
-from src.main.prompts.transaction_extraction import TRANSACTION_EXTRACTION_PROMPT
-from src.main.models.balance_analysis import PageTransactions, Transaction
+from src.main.llm_cache import (
+    cache_response,
+    cached_parse,
+    get_cached_response,
+    prompt_messages,
+)
+from src.main.prompts.transaction_extraction import (
+    TRANSACTION_EXTRACTION_MULTI_PAGE_PROMPT,
+    TRANSACTION_EXTRACTION_PROMPT,
+)
+from src.main.models.balance_analysis import (
+    MultiPageTransactions,
+    PageTransactions,
+    Transaction,
+)
+
+logger = logging.getLogger(__name__)
 
 # Maximum number of transactions (2000/month * 12 months * 10 years)
 MAX_TRANSACTIONS = 24000
+# Maximum number of pages sent to the model at the same time
+MAX_PARALLEL_PAGE_EXTRACTIONS = 10
+# Estimated response tokens of the pages sent together in one request, kept
+# well below the model's 16k output limit
+PAGE_GROUP_OUTPUT_TOKEN_BUDGET = 8_000
+# Rough response size of one extracted transaction, and of a page's entry
+OUTPUT_TOKENS_PER_TRANSACTION = 50
+OUTPUT_TOKENS_PER_PAGE = 20
+# Maximum number of pages sent together in one request; the model is more
+# likely to merge or drop pages the more of them a single response covers
+MAX_PAGES_PER_REQUEST = 8
+# Statements with at least this many pages use the Batch API in batch mode
+BATCH_MIN_PAGES = 50
+# Seconds between checks on the status of a submitted batch
+BATCH_POLL_INTERVAL = 30
+# SDK retries of the file and batch calls of a batch
+BATCH_MAX_RETRIES = 2
+# Seconds to wait for a batch before cancelling it and extracting the pages
+# still missing directly
+BATCH_MAX_WAIT = 2 * 60 * 60
+
+TRANSACTION_EXTRACTION_MODEL = "gpt-4o-mini"
+
+# A date, e.g. 03/15, 15.03.2024, 2024-03-15, Mar 15 or 15 Mar, followed by
+# an amount with cents on the same line
+_DATE_AMOUNT_LINE_RE = re.compile(
+    r"(?:\b\d{1,2}[./-]\d{1,2}(?:[./-]\d{2,4})?\b|\b\d{4}-\d{2}-\d{2}\b"
+    r"|\b(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?\s+\d{1,2}\b"
+    r"|\b\d{1,2}\s+(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\b)"
+    r".*?\d[.,]\d{2}\b",
+    re.IGNORECASE)
+_CURRENCY_RE = re.compile(r"[$€£¥]|\b(?:USD|EUR|GBP|CAD|AUD|CHF|JPY)\b")
+
+
+def _log_page(page_number: int, page: str) -> None:
+    # Pages can be long, so they are only formatted when debugging
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Extracting transactions from page %d:\n%s",
+                     page_number, page)
+
+
+def _page_has_transactions(page: str) -> bool:
+    """
+    Whether a page may list transactions: it has a line with a date followed
+    by an amount, or at least a currency. Cover pages, terms and conditions
+    and blank pages have neither.
+    """
+    return bool(_DATE_AMOUNT_LINE_RE.search(page) or _CURRENCY_RE.search(page))
+
+
+def _page_messages(page: str) -> List[Dict[str, str]]:
+    return prompt_messages(TRANSACTION_EXTRACTION_PROMPT, text=page)
+
+
+def _extract_page_transactions(page_number: int, page: str) -> List[Transaction]:
+    """
+    Extract the transactions from a single bank statement page.
+
+    Args:
+        page_number: 1-based page number, used for progress output
+        page: Text of the page
+
+    Returns:
+        List of Transaction objects found on the page
+    """
+    _log_page(page_number, page)
+    page_transactions = cached_parse(
+        model=TRANSACTION_EXTRACTION_MODEL,
+        messages=_page_messages(page),
+        response_format=PageTransactions,
+    )
+    return page_transactions.transactions
+
+
+def _estimate_output_tokens(page: str) -> int:
+    # Each transaction is usually a line with a date and an amount, and its
+    # JSON in the response is larger than the line itself
+    return (OUTPUT_TOKENS_PER_PAGE
+            + OUTPUT_TOKENS_PER_TRANSACTION * len(_DATE_AMOUNT_LINE_RE.findall(page)))
+
+
+def _group_pages(
+        pages: Iterable[Tuple[int, str]]) -> Iterator[List[Tuple[int, str]]]:
+    """
+    Split (index, text) pages into consecutive groups of at most
+    MAX_PAGES_PER_REQUEST pages whose estimated response stays within
+    PAGE_GROUP_OUTPUT_TOKEN_BUDGET tokens. A page over the budget on its own
+    gets a group of its own.
+
+    Groups are yielded as soon as they are complete, so requests for the
+    first pages can start while later pages are still being read.
+    """
+    group: List[Tuple[int, str]] = []
+    group_tokens = 0
+    for index, page in pages:
+        tokens = _estimate_output_tokens(page)
+        if group and (len(group) == MAX_PAGES_PER_REQUEST
+                      or group_tokens + tokens > PAGE_GROUP_OUTPUT_TOKEN_BUDGET):
+            yield group
+            group = []
+            group_tokens = 0
+        group.append((index, page))
+        group_tokens += tokens
+    if group:
+        yield group
+
+
+def _extract_page_group_transactions(
+        group: List[Tuple[int, str]]) -> List[List[Transaction]]:
+    """
+    Extract the transactions from several pages with a single request.
+
+    Falls back to one request per page if the response is cut off at the
+    output limit, can't be parsed or doesn't contain exactly one entry per
+    page.
+
+    Args:
+        group: (0-based index, text) of the pages to extract
+
+    Returns:
+        List of the transactions of each page in the group
+    """
+    if len(group) == 1:
+        index, page = group[0]
+        return [_extract_page_transactions(index + 1, page)]
 
+    for index, page in group:
+        _log_page(index + 1, page)
+    try:
+        response = cached_parse(
+            model=TRANSACTION_EXTRACTION_MODEL,
+            messages=prompt_messages(
+                TRANSACTION_EXTRACTION_MULTI_PAGE_PROMPT,
+                pages="\n\n".join(
+                    f"--- PAGE {index + 1} ---\n{page}" for index, page in group)),
+            response_format=MultiPageTransactions,
+        )
+    except openai.LengthFinishReasonError:
+        logger.info("Response for pages %d to %d hit the output limit, "
+                    "extracting them one by one", group[0][0] + 1, group[-1][0] + 1)
+        response = None
+    if response is not None and len(response.pages) == len(group):
+        return [page.transactions for page in response.pages]
 
-def extract_transactions(pdf_path: str) -> List[Transaction]:
+    return [_extract_page_transactions(index + 1, page)
+            for index, page in group]
+
+
+def _response_format_param(response_format: type) -> Dict:
+    """
+    JSON schema response format for a Pydantic model, as sent by
+    beta.chat.completions.parse. Batch requests are plain JSON, so the
+    schema is built with the SDK's helper, which is private and may move in
+    a later release of openai.
+    """
+    return type_to_response_format_param(response_format)
+
+
+def _extract_pages_batch(
+        pages: List[Tuple[int, str]],
+        cancel: threading.Event) -> Dict[int, List[Transaction]]:
+    """
+    Extract the transactions from pages with the OpenAI Batch API.
+
+    Pages with a cached response are not sent. Batches are cheaper than
+    regular requests but may take a long time to complete.
+
+    Args:
+        pages: (0-based index, text) of the pages to extract
+        cancel: Once set, no batch is submitted and a submitted batch is
+            cancelled
+
+    Returns:
+        Transactions by 0-based page index, for every page that was cached or
+        completed successfully in the batch
+    """
+    results: Dict[int, List[Transaction]] = {}
+    requests: Dict[int, List[Dict[str, str]]] = {}
+    for index, page in pages:
+        messages = _page_messages(page)
+        cached = get_cached_response(
+            TRANSACTION_EXTRACTION_MODEL, messages, PageTransactions)
+        if cached is not None:
+            results[index] = cached.transactions
+        else:
+            requests[index] = messages
+    if not requests or cancel.is_set():
+        return results
+
+    response_format = _response_format_param(PageTransactions)
+    batch_input = "\n".join(
+        json.dumps({
+            "custom_id": f"page-{index}",
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": TRANSACTION_EXTRACTION_MODEL,
+                "messages": messages,
+                "response_format": response_format,
+            },
+        })
+        for index, messages in requests.items()
+    )
+
+    # The shared client leaves retries to RateLimitedClient, which only
+    # covers completions, so the batch calls use the SDK's own retries
+    client = get_openai_client().with_options(max_retries=BATCH_MAX_RETRIES)
+    input_file = client.files.create(
+        file=("transactions.jsonl", io.BytesIO(batch_input.encode())),
+        purpose="batch",
+    )
+    if cancel.is_set():
+        return results
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    print(f"Submitted batch {batch.id} with {len(requests)} pages")
+
+    deadline = time.monotonic() + BATCH_MAX_WAIT
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        # Wakes up as soon as the extraction is cancelled
+        if cancel.wait(BATCH_POLL_INTERVAL) or time.monotonic() > deadline:
+            logger.warning("Cancelling batch %s", batch.id)
+            client.batches.cancel(batch.id)
+            return results
+        batch = client.batches.retrieve(batch.id)
+    if batch.status != "completed":
+        # Expired batches still return the requests that finished; the
+        # pages without a result are extracted directly by the caller
+        logger.warning("Batch %s ended with status %s, keeping its partial output",
+                       batch.id, batch.status)
+    if batch.output_file_id is None:
+        return results
+
+    for line in client.files.content(batch.output_file_id).text.splitlines():
+        if not line.strip():
+            continue
+        output = json.loads(line)
+        response = output.get("response")
+        if output.get("error") or not response or response["status_code"] != 200:
+            continue
+        index = int(output["custom_id"].removeprefix("page-"))
+        content = response["body"]["choices"][0]["message"]["content"]
+        page_transactions = PageTransactions.model_validate_json(content)
+        cache_response(TRANSACTION_EXTRACTION_MODEL,
+                       requests[index], page_transactions)
+        results[index] = page_transactions.transactions
+
+    return results
+
+
+def extract_transactions(
+    pdf_path: str,
+    max_parallel_requests: int = MAX_PARALLEL_PAGE_EXTRACTIONS,
+    batch_mode: bool = False,
+    cancel: Optional[threading.Event] = None,
+) -> List[Transaction]:
     """
     Extract transactions from bank statement pages.
 
+    Consecutive pages are grouped into requests of up to
+    MAX_PAGES_PER_REQUEST pages and PAGE_GROUP_OUTPUT_TOKEN_BUDGET estimated
+    response tokens, and each request is sent as soon as its pages have been
+    read, concurrently with the others; the transactions are returned in
+    page order.
+
+    In batch mode, statements of at least BATCH_MIN_PAGES pages are sent
+    through the Batch API instead, which costs less but takes longer. Pages
+    that fail in the batch, or that it hasn't finished within BATCH_MAX_WAIT
+    seconds, are extracted directly.
+
     Args:
-        pages_md: List of markdown text for each page of the bank statement
+        pdf_path: Path to the PDF file
+        max_parallel_requests: Maximum number of requests sent at once
+        batch_mode: Whether to use the Batch API for long statements
+        cancel: Set by the caller once the transactions are no longer
+            needed; no further requests are sent and an empty list is
+            returned
 
     Returns:
         List of Transaction objects
     """
+    results: Dict[int, List[Transaction]] = {}
+    # Pages 0 to completed_pages - 1 are all extracted, with
+    # completed_transactions transactions between them
+    completed_pages = 0
+    completed_transactions = 0
+    # Set once the completed pages hold more than MAX_TRANSACTIONS
+    # transactions; the pages after them would be truncated anyway
+    limit_reached = False
+
+    def record_pages(pages: Dict[int, List[Transaction]]) -> None:
+        nonlocal completed_pages, completed_transactions, limit_reached
+        results.update(pages)
+        while completed_pages in results:
+            completed_transactions += len(results[completed_pages])
+            completed_pages += 1
+        if completed_transactions > MAX_TRANSACTIONS:
+            limit_reached = True
+
+    def transaction_pages(pages: Iterable[str]) -> Iterator[Tuple[int, str]]:
+        # Pages that can't contain transactions are never sent to the model
+        for i, page in enumerate(pages):
+            if _page_has_transactions(page):
+                yield i, page
+            else:
+                record_pages({i: []})
+
+    cancel = cancel or threading.Event()
+    if batch_mode and get_pdf_page_count(pdf_path) >= BATCH_MIN_PAGES:
+        pages = list(transaction_pages(extract_pdf_pages(pdf_path)))
+        record_pages(_extract_pages_batch(pages, cancel))
+        remaining: Iterable[Tuple[int, str]] = [
+            (i, page) for i, page in pages if i not in results]
+    else:
+        # Stream the pages so requests start while the PDF is still being read
+        remaining = transaction_pages(extract_pdf_pages(pdf_path))
+
+    executor = ThreadPoolExecutor(max_workers=max_parallel_requests)
+    # Limits the groups waiting for the LLM so reading the PDF can't run far
+    # ahead of the requests
+    pending_groups = threading.BoundedSemaphore(2 * max_parallel_requests)
+    # Set as soon as any request fails, so reading the PDF stops early
+    failed = threading.Event()
+    futures = {}
+
+    def on_group_done(future):
+        pending_groups.release()
+        if future.cancelled() or future.exception() is not None:
+            failed.set()
+
+    def record_group(future) -> None:
+        # Results are recorded on this thread rather than in the done
+        # callback: waiters are woken before callbacks run, so a callback
+        # could still be storing pages after the last wait has returned.
+        # Raises the exception of a failed request
+        record_pages({i: page_transactions for (i, _), page_transactions
+                      in zip(futures.pop(future), future.result())})
+
+    try:
+        for group in _group_pages(remaining):
+            pending_groups.acquire()
+            for future in [future for future in futures if future.done()]:
+                record_group(future)
+            if failed.is_set() or cancel.is_set() or limit_reached:
+                pending_groups.release()
+                break
+            future = executor.submit(_extract_page_group_transactions, group)
+            futures[future] = group
+            future.add_done_callback(on_group_done)
+
+        for future in as_completed(list(futures)):
+            if cancel.is_set():
+                break
+            record_group(future)
+            if limit_reached:
+                break
+    finally:
+        # Don't wait for the remaining pages once a request has failed or
+        # enough transactions were extracted
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    if cancel.is_set():
+        return []
+    page_results = [results[i] for i in range(completed_pages)]
+
     all_transactions: List[Transaction] = []
     currency = None
-
-    i = 1
-    for page in extract_pdf_pages(pdf_path):
-        print(f"Extracting transactions from page {i}...")
-        print(page)
-        i += 1
-        page_transactions = get_openai_client().beta.chat.completions.parse(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "user", "content": str(
-                    TRANSACTION_EXTRACTION_PROMPT.invoke({"text": page}))},
-            ],
-            response_format=PageTransactions,
-        ).choices[0].message.parsed
-        new_transactions = page_transactions.transactions
-        if currency is None:
-            currency = new_transactions[0].money.currency
-        else:
-            for tx in new_transactions:
-                if tx.money.currency != currency:
-                    raise ValueError(
-                        f"Transactions have different currencies: {currency} and {tx.money.currency}")
+    for new_transactions in page_results:
+        # Pages almost always use a single currency, so compare the set of
+        # distinct currencies on the page instead of every transaction
+        page_currencies = {normalize_currency(tx.money.currency)
+                           for tx in new_transactions}
+        if currency is None and page_currencies:
+            currency = min(page_currencies)
+        other_currencies = page_currencies - {currency}
+        if other_currencies:
+            raise ValueError(
+                f"Transactions have different currencies: {currency} and {min(other_currencies)}")
         all_transactions.extend(new_transactions)
         # Check if we've exceeded the maximum number of transactions
         if len(all_transactions) > MAX_TRANSACTIONS:
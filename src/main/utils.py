@@ -1,44 +1,142 @@
-from decimal import Decimal
-from typing import Dict, Generator, List
+from collections import OrderedDict
+from decimal import ROUND_HALF_UP, Decimal
+import hashlib
+import os
+import threading
+from typing import Dict, Generator, List, Tuple
 from src.main.models.balance_analysis import Money
-from PyPDF2 import PdfReader
+from src.main.ocr import OCR_MIN_CHARACTERS, OCR_RENDER_SCALE, transcribe_page_image
+import pypdfium2 as pdfium
+
+# PDFium is not thread-safe, so every call into it is serialized
+_PDFIUM_LOCK = threading.Lock()
+
+# Open PDFium documents by (absolute path, modification time, size), least
+# recently used first
+MAX_OPEN_DOCUMENTS = 8
+_OPEN_DOCUMENTS: "OrderedDict[Tuple[str, int, int], pdfium.PdfDocument]" = OrderedDict()
 
 
 def get_pdf_metadata(pdf_path):
     """Extract metadata from a PDF file."""
-    reader = PdfReader(pdf_path)
-    metadata = reader.metadata
+    pdf = open_pdf(pdf_path)
+    with _PDFIUM_LOCK:
+        page_count = len(pdf)
+        metadata = pdf.get_metadata_dict()
     return {
-        "Pages": len(reader.pages),
-        "Title": metadata.get("/Title", "Not available") if metadata is not None else "Not available",
-        "Author": metadata.get("/Author", "Not available") if metadata is not None else "Not available",
-        "Creator": metadata.get("/Creator", "Not available") if metadata is not None else "Not available",
-        "Producer": metadata.get("/Producer", "Not available") if metadata is not None else "Not available",
-        "Creation Date": metadata.get("/CreationDate", "Not available") if metadata is not None else "Not available",
-        "Modification Date": metadata.get("/ModDate", "Not available") if metadata is not None else "Not available"
+        "Pages": page_count,
+        "Title": metadata.get("Title") or "Not available",
+        "Author": metadata.get("Author") or "Not available",
+        "Creator": metadata.get("Creator") or "Not available",
+        "Producer": metadata.get("Producer") or "Not available",
+        "Creation Date": metadata.get("CreationDate") or "Not available",
+        "Modification Date": metadata.get("ModDate") or "Not available"
     }
 
 
+def normalize_currency(currency: str) -> str:
+    """Normalize a currency code, e.g. " eur" to "EUR"."""
+    return currency.strip().upper()
+
+
 def sum_moneys(moneys: List[Money]) -> List[Money]:
-    currency_total: Dict[str, Decimal] = {}
+    # Totals are kept in exact integer cents and converted back once
+    currency_total: Dict[str, int] = {}
     for money in moneys:
-        currency = money.currency.upper()
-        current_total = currency_total.get(currency, Decimal(0))
-        currency_total[currency] = current_total + Decimal(money.amount)
-    return [Money(amount=float(amount), currency=currency)
-            for currency, amount in currency_total.items()]
+        currency = normalize_currency(money.currency)
+        currency_total[currency] = currency_total.get(
+            currency, 0) + to_minor_units(money.amount)
+    return [Money(amount=from_minor_units(cents), currency=currency)
+            for currency, cents in currency_total.items()]
+
+
+def file_sha256(path: str) -> str:
+    """Hash the contents of a file, reading it in 1 MiB blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def to_minor_units(amount: float) -> int:
+    """Convert an amount of money to an exact integer number of cents."""
+    return int(Decimal(str(amount)).scaleb(2).quantize(
+        Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_minor_units(cents: int) -> float:
+    """Convert an integer number of cents back to an amount of money."""
+    return float(Decimal(cents).scaleb(-2))
+
+
+def _page_text(pdf: pdfium.PdfDocument, index: int) -> str:
+    """
+    Extract the text of a single page of an open PDF. Pages without a text
+    layer, such as scanned pages, are rendered and transcribed instead.
+    """
+    image = None
+    with _PDFIUM_LOCK:
+        page = pdf[index]
+        textpage = page.get_textpage()
+        try:
+            text = textpage.get_text_range()
+            if len(text.strip()) < OCR_MIN_CHARACTERS:
+                bitmap = page.render(scale=OCR_RENDER_SCALE)
+                image = bitmap.to_pil().copy()
+                bitmap.close()
+        finally:
+            textpage.close()
+            page.close()
+    if image is not None:
+        text = transcribe_page_image(image)
+    return text.replace("\r\n", "\n")
+
+
+def open_pdf(pdf_path: str) -> pdfium.PdfDocument:
+    """
+    Open a PDF with PDFium. The document is shared with every caller that
+    opens the same unchanged file, so it is only parsed once per run. PDFium
+    reads the file on demand through its own file handle, so large documents
+    are never loaded into memory as a whole.
+    """
+    stat = os.stat(pdf_path)
+    key = (os.path.abspath(pdf_path), stat.st_mtime_ns, stat.st_size)
+    with _PDFIUM_LOCK:
+        pdf = _OPEN_DOCUMENTS.get(key)
+        if pdf is None:
+            pdf = pdfium.PdfDocument(key[0])
+            _OPEN_DOCUMENTS[key] = pdf
+            # Evicted documents are closed once no caller uses them any more
+            if len(_OPEN_DOCUMENTS) > MAX_OPEN_DOCUMENTS:
+                _OPEN_DOCUMENTS.popitem(last=False)
+        else:
+            _OPEN_DOCUMENTS.move_to_end(key)
+    return pdf
+
+
+def _page_count(pdf: pdfium.PdfDocument) -> int:
+    with _PDFIUM_LOCK:
+        return len(pdf)
+
+
+def get_pdf_page_count(pdf_path: str) -> int:
+    """Count the pages of a PDF without extracting their text."""
+    return _page_count(open_pdf(pdf_path))
 
 
 def extract_pdf_pages(pdf_path: str) -> Generator[str, None, None]:
     """Extract each page of a PDF as separate markdown texts."""
-    reader = PdfReader(pdf_path)
-    for page in reader.pages:
-        yield page.extract_text()
+    # PDFium extracts a page in a few milliseconds, far less than starting a
+    # worker process would cost, so pages are extracted in this process
+    pdf = open_pdf(pdf_path)
+    for i in range(_page_count(pdf)):
+        yield _page_text(pdf, i)
 
 
 def get_first_page_as_markdown(pdf_path: str) -> str:
     """Extract only the first page of a PDF as markdown text."""
-    reader = PdfReader(pdf_path)
-    if len(reader.pages) == 0:
+    pdf = open_pdf(pdf_path)
+    if _page_count(pdf) == 0:
         return ""
-    return reader.pages[0].extract_text()
+    return _page_text(pdf, 0)
@@ -0,0 +1,56 @@
+import time
+
+from src.main import app, transaction_extraction
+from src.main.models.balance_analysis import BalanceAnalysis, Money
+from src.main.models.business_info import Address, BusinessInfo
+from src.main.models.first_page_analysis import FirstPageAnalysis
+from src.main.models.is_bank_statement import IsBankStatement
+
+PAGE_COUNT = 200
+
+
+def test_invalid_business_info_stops_transaction_extraction(monkeypatch):
+    pages_read = 0
+    requests = []
+
+    def slow_pages(pdf_path):
+        nonlocal pages_read
+        for _ in range(PAGE_COUNT):
+            time.sleep(0.01)
+            pages_read += 1
+            yield "01/02/2024 Coffee $3.50"
+
+    def extract_group(group):
+        requests.append(group)
+        return [[] for _ in group]
+
+    monkeypatch.setattr(app, "get_first_page_as_markdown",
+                        lambda pdf_path: "first page")
+    monkeypatch.setattr(app, "check_is_business_bank_statement",
+                        lambda first_page_md: IsBankStatement(
+                            is_bank_statement=True, reason="statement"))
+    monkeypatch.setattr(app, "analyze_first_page",
+                        lambda first_page_md: FirstPageAnalysis(
+                            business=BusinessInfo(
+                                name="",
+                                address=Address(street="", city="", state="",
+                                                zip="", country="")),
+                            balances=BalanceAnalysis(
+                                opening_balance=Money(amount=0, currency="USD"),
+                                opening_date="2024-01-01",
+                                closing_balance=Money(amount=0, currency="USD"),
+                                closing_date="2024-01-31")))
+    monkeypatch.setattr(transaction_extraction, "extract_pdf_pages", slow_pages)
+    monkeypatch.setattr(transaction_extraction,
+                        "_extract_page_group_transactions", extract_group)
+
+    result = app.analyze_bank_statement("statement.pdf")
+
+    assert result.is_valid_business_info is False
+    # The extraction stops within the groups already in flight, so no more
+    # pages are read after that
+    time.sleep(0.5)
+    stopped_at = pages_read
+    time.sleep(0.5)
+    assert pages_read == stopped_at < PAGE_COUNT
+    assert sum(len(group) for group in requests) < PAGE_COUNT